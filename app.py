@@ -1,177 +1,273 @@
 
+import multiprocessing
+import os
 import sqlite3
-from flask import Flask, request, jsonify, g
-from werkzeug.security import generate_password_hash, check_password_hash # For password hashing
-from db import get_db, init_app # Import our database functions
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Annotated, Optional
+import msgspec
+import orjson
+from flask import Flask, Response, request, g
+from db import get_db, get_read_db, init_app # Import our database functions
+from db import hash_password, check_password, needs_rehash, password_too_long, BCRYPT_MAX_PASSWORD_BYTES # Password helpers
 
 app = Flask(__name__)
 
 # Register the init_app function from db.py to handle database closing
 init_app(app)
 
+# bcrypt verification is deliberately slow; run it in worker processes so a burst of logins
+# can't tie up the threads serving cheaper requests. Processes are started with 'spawn' so
+# they don't inherit this process's threads or open SQLite connections. A spawned child
+# re-imports __main__ (app.py itself under "python app.py"), so nothing here may have side
+# effects: the pool is built on the first login, and init_app() skips its database work.
+password_executor = None
+password_slots = None # Counts free pool processes, so a login never queues behind a busy pool
+password_executor_lock = threading.Lock()
+
+def _password_workers():
+    """
+    Size of this process's password pool: an equal share of the cores per gunicorn worker.
+    gunicorn.conf.py exports the live worker count as WEB_CONCURRENCY in each worker.
+    """
+    return max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+def _get_password_executor(broken=None):
+    """
+    Returns the password pool, creating it on first use or replacing 'broken' if it is current.
+    """
+    global password_executor, password_slots
+    with password_executor_lock:
+        if password_executor is None or password_executor is broken:
+            size = _password_workers()
+            password_executor = ProcessPoolExecutor(max_workers=size,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            if password_slots is None:
+                password_slots = threading.BoundedSemaphore(size)
+        return password_executor
+
+def verify_password(password, hashed_password):
+    """
+    Runs check_password in the password process pool.
+    When every pool process is busy, the check runs in the calling thread instead: bcrypt
+    releases the GIL, so it still runs in parallel rather than waiting for a slot.
+    If a pool process has died, the pool is replaced and this check runs in the calling thread.
+    """
+    executor = _get_password_executor()
+    if not password_slots.acquire(blocking=False):
+        return check_password(password, hashed_password)
+    try:
+        return executor.submit(check_password, password, hashed_password).result()
+    except BrokenProcessPool:
+        _get_password_executor(broken=executor)
+        executor.shutdown(wait=False)
+        return check_password(password, hashed_password)
+    finally:
+        password_slots.release()
+
+def jresp(payload, status=200):
+    """
+    Builds a JSON response with orjson, which encodes lists of dicts in C.
+    Used in place of flask.jsonify by every route. Already-encoded bytes are sent as-is.
+    """
+    body = payload if isinstance(payload, bytes) else orjson.dumps(payload)
+    return Response(body, status=status, mimetype='application/json')
+
+# Fixed response bodies, encoded once at import; routes only wrap them in a fresh Response
+WELCOME = orjson.dumps({"message": "Welcome to the User Management System API"})
+USER_NOT_FOUND = orjson.dumps({"message": "User not found"})
+MISSING_USER_FIELDS = orjson.dumps({"message": "Missing name, email, or password"})
+INVALID_JSON = orjson.dumps({"message": "Invalid JSON"})
+PASSWORD_TOO_LONG = orjson.dumps({"message": f"Password must be at most {BCRYPT_MAX_PASSWORD_BYTES} bytes"})
+EMAIL_TAKEN = orjson.dumps({"message": "User with this email already exists"})
+INTERNAL_ERROR = orjson.dumps({"message": "An internal server error occurred"})
+INVALID_UPDATE_FIELDS = orjson.dumps({"message": "Name and email must be strings"})
+NO_UPDATE_DATA = orjson.dumps({"message": "No data provided for update"})
+USER_UPDATED = orjson.dumps({"message": "User updated successfully"})
+USER_DELETED = orjson.dumps({"message": "User deleted successfully"})
+MISSING_SEARCH_NAME = orjson.dumps({"message": "Please provide a 'name' query parameter to search"})
+INVALID_SEARCH_MODE = orjson.dumps({"message": "The 'mode' query parameter must be 'prefix' or 'substring'"})
+MISSING_LOGIN_FIELDS = orjson.dumps({"message": "Missing email or password"})
+INVALID_CREDENTIALS = orjson.dumps({"status": "failed", "message": "Invalid credentials"})
+
+# Request bodies, decoded and validated from the raw JSON bytes in a single msgspec pass.
+# Decoders are built once here rather than per request.
+NonEmptyStr = Annotated[str, msgspec.Meta(min_length=1)]
+
+class CreateUser(msgspec.Struct):
+    name: NonEmptyStr
+    email: NonEmptyStr
+    password: NonEmptyStr
+
+class UpdateUser(msgspec.Struct):
+    name: Optional[str] = None
+    email: Optional[str] = None
+
+class Login(msgspec.Struct):
+    email: NonEmptyStr
+    password: NonEmptyStr
+
+create_user_decoder = msgspec.json.Decoder(CreateUser)
+update_user_decoder = msgspec.json.Decoder(UpdateUser)
+login_decoder = msgspec.json.Decoder(Login)
+
 @app.route('/')
 def home():
-    return jsonify({"message": "Welcome to the User Management System API"}), 200
+    return jresp(WELCOME, 200)
 
 @app.route('/users', methods=['GET'])
 def get_all_users():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT id, name, email FROM users") # Don't return password in GET
-    users = cursor.fetchall()
-    # Convert list of Row objects to list of dictionaries for jsonify
-    users_list = [dict(user) for user in users]
-    return jsonify(users_list), 200
+    db = get_read_db()
+    users = db.execute("SELECT id, name, email FROM users").fetchall() # Don't return password in GET
+    # Build the response dictionaries straight from the (id, name, email) tuples
+    users_list = [{"id": uid, "name": uname, "email": uemail} for uid, uname, uemail in users]
+    return jresp(users_list, 200)
 
 @app.route('/user/<int:user_id>', methods=['GET']) # Use int converter for user_id
 def get_user(user_id):
-    db = get_db()
-    cursor = db.cursor()
+    db = get_read_db()
     # Use parameterized query to prevent SQL Injection
-    cursor.execute("SELECT id, name, email FROM users WHERE id = ?", (user_id,)) # Don't return password
-    user = cursor.fetchone()
+    user = db.execute("SELECT id, name, email FROM users WHERE id = ?", (user_id,)).fetchone() # Don't return password
 
     if user:
-        return jsonify(dict(user)), 200
+        return jresp({"id": user[0], "name": user[1], "email": user[2]}, 200)
     else:
-        return jsonify({"message": "User not found"}), 404 # Use proper HTTP status code
+        return jresp(USER_NOT_FOUND, 404) # Use proper HTTP status code
 
 @app.route('/users', methods=['POST'])
 def create_user():
-    data = request.get_json() # Use get_json() for JSON payloads
-    if not data:
-        return jsonify({"message": "Invalid JSON"}), 400
+    # Basic input validation: all three fields must be non-empty strings
+    try:
+        data = create_user_decoder.decode(request.get_data(cache=False))
+    except msgspec.ValidationError:
+        return jresp(MISSING_USER_FIELDS, 400)
+    except msgspec.DecodeError:
+        return jresp(INVALID_JSON, 400)
 
-    name = data.get('name')
-    email = data.get('email')
-    password = data.get('password')
+    name, email, password = data.name, data.email, data.password
+    if password_too_long(password):
+        return jresp(PASSWORD_TOO_LONG, 400)
 
-    # Basic input validation
-    if not all([name, email, password]):
-        return jsonify({"message": "Missing name, email, or password"}), 400
+    # Turn away a taken email before paying for bcrypt. Checking first also keeps ON CONFLICT
+    # below from burning an AUTOINCREMENT id, except when two signups race for the same email
+    if get_read_db().execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone():
+        return jresp(EMAIL_TAKEN, 409) # Conflict
 
     # Hash the password before storing
-    hashed_password = generate_password_hash(password)
+    hashed_password = hash_password(password)
 
     db = get_db()
-    cursor = db.cursor()
     try:
-        # Use parameterized query to prevent SQL Injection
-        cursor.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-                       (name, email, hashed_password))
-        db.commit()
+        # Use parameterized query to prevent SQL Injection.
+        # A duplicate email is skipped by ON CONFLICT instead of raising, so no row comes back
+        created = db.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?) "
+                             "ON CONFLICT(email) DO NOTHING RETURNING id",
+                             (name, email, hashed_password)).fetchone()
+        if created is None:
+            return jresp(EMAIL_TAKEN, 409) # Conflict
         # Return the ID of the newly created user
-        return jsonify({"message": "User created successfully!", "user_id": cursor.lastrowid}), 201 # 201 Created
-    except sqlite3.IntegrityError:
-        # This error occurs if email is not unique
-        return jsonify({"message": "User with this email already exists"}), 409 # Conflict
+        return jresp({"message": "User created successfully!", "user_id": created['id']}, 201) # 201 Created
     except Exception as e:
         # Log the error properly in a real app
         print(f"Error creating user: {e}")
-        return jsonify({"message": "An internal server error occurred"}), 500 # Internal Server Error
+        return jresp(INTERNAL_ERROR, 500) # Internal Server Error
 
 @app.route('/user/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
-    data = request.get_json()
-    if not data:
-        return jsonify({"message": "Invalid JSON"}), 400
+    try:
+        data = update_user_decoder.decode(request.get_data(cache=False))
+    except msgspec.ValidationError:
+        return jresp(INVALID_UPDATE_FIELDS, 400)
+    except msgspec.DecodeError:
+        return jresp(INVALID_JSON, 400)
 
-    name = data.get('name')
-    email = data.get('email')
+    name, email = data.name, data.email
 
     # Basic validation: ensure at least one field is provided for update
     if not (name or email):
-        return jsonify({"message": "No data provided for update"}), 400
+        return jresp(NO_UPDATE_DATA, 400)
 
     db = get_db()
-    cursor = db.cursor()
-    update_fields = []
-    update_values = []
-
-    if name:
-        update_fields.append("name = ?")
-        update_values.append(name)
-    if email:
-        update_fields.append("email = ?")
-        update_values.append(email)
-
-    if not update_fields:
-        return jsonify({"message": "No valid fields to update"}), 400
-
-    update_query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
-    update_values.append(user_id) # Add user_id to the end for the WHERE clause
-
     try:
-        cursor.execute(update_query, tuple(update_values))
-        db.commit()
-
-        if cursor.rowcount == 0:
-            # Check if user exists before attempting update again
-            cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-            if cursor.fetchone() is None:
-                return jsonify({"message": "User not found"}), 404
-            else:
-                return jsonify({"message": "User found but no changes made (data was identical)"}), 200 # No actual change
-        return jsonify({"message": "User updated successfully"}), 200
+        # One fixed statement for every combination of fields: a NULL parameter
+        # leaves that column unchanged, so the prepared statement is always reused.
+        # RETURNING tells us in the same round-trip whether the user exists.
+        updated = db.execute("UPDATE users SET name = COALESCE(?, name), email = COALESCE(?, email) "
+                             "WHERE id = ? RETURNING id",
+                             (name or None, email or None, user_id)).fetchone()
+
+        if updated is None:
+            return jresp(USER_NOT_FOUND, 404)
+        return jresp(USER_UPDATED, 200)
     except sqlite3.IntegrityError:
-        return jsonify({"message": "User with this email already exists"}), 409
+        return jresp(EMAIL_TAKEN, 409)
     except Exception as e:
         print(f"Error updating user: {e}")
-        return jsonify({"message": "An internal server error occurred"}), 500
+        return jresp(INTERNAL_ERROR, 500)
 
 @app.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     db = get_db()
-    cursor = db.cursor()
     # Use parameterized query
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    db.commit()
+    cursor = db.execute("DELETE FROM users WHERE id = ?", (user_id,))
 
     if cursor.rowcount == 0:
-        return jsonify({"message": "User not found"}), 404
-    return jsonify({"message": "User deleted successfully"}), 200
+        return jresp(USER_NOT_FOUND, 404)
+    return jresp(USER_DELETED, 200)
 
 @app.route('/search', methods=['GET'])
 def search_users():
     name = request.args.get('name')
+    mode = request.args.get('mode', 'prefix')
 
     if not name:
-        return jsonify({"message": "Please provide a 'name' query parameter to search"}), 400
+        return jresp(MISSING_SEARCH_NAME, 400)
+    if mode not in ('prefix', 'substring'):
+        return jresp(INVALID_SEARCH_MODE, 400)
 
-    db = get_db()
-    cursor = db.cursor()
+    db = get_read_db()
     # Use parameterized query with LIKE wildcard
     # Note: '%' must be part of the parameter, not the query string for security
-    search_pattern = f"%{name}%"
-    cursor.execute("SELECT id, name, email FROM users WHERE name LIKE ?", (search_pattern,))
-    users = cursor.fetchall()
+    if mode == 'prefix':
+        # A bound pattern with only a trailing wildcard lets SQLite seek idx_users_name instead of scanning
+        users = db.execute("SELECT id, name, email FROM users WHERE name LIKE ?", (f"{name}%",)).fetchall()
+    else:
+        # Substring matches are answered by the trigram index in users_fts
+        users = db.execute("SELECT id, name, email FROM users WHERE id IN "
+                           "(SELECT rowid FROM users_fts WHERE name LIKE ?)", (f"%{name}%",)).fetchall()
 
-    users_list = [dict(user) for user in users]
-    return jsonify(users_list), 200
+    users_list = [{"id": uid, "name": uname, "email": uemail} for uid, uname, uemail in users]
+    return jresp(users_list, 200)
 
 @app.route('/login', methods=['POST'])
 def login():
-    data = request.get_json()
-    if not data:
-        return jsonify({"message": "Invalid JSON"}), 400
-
-    email = data.get('email')
-    password = data.get('password')
-
-    if not all([email, password]):
-        return jsonify({"message": "Missing email or password"}), 400
-
-    db = get_db()
-    cursor = db.cursor()
-    # Use parameterized query
-    cursor.execute("SELECT id, password FROM users WHERE email = ?", (email,))
-    user = cursor.fetchone()
-
-    # If user exists, check hashed password
-    if user and check_password_hash(user['password'], password):
-        return jsonify({"status": "success", "user_id": user['id']}), 200
+    try:
+        data = login_decoder.decode(request.get_data(cache=False))
+    except msgspec.ValidationError:
+        return jresp(MISSING_LOGIN_FIELDS, 400)
+    except msgspec.DecodeError:
+        return jresp(INVALID_JSON, 400)
+
+    email, password = data.email, data.password
+
+    db = get_read_db()
+    # Use parameterized query; the covering index serves this without a table lookup
+    user = db.execute("SELECT id, password FROM users INDEXED BY idx_users_email_cover WHERE email = ?",
+                      (email,)).fetchone()
+
+    # If user exists, check hashed password (row is an (id, password) tuple)
+    if user and verify_password(password, user[1]):
+        if needs_rehash(user[1]) and not password_too_long(password):
+            # Upgrade a legacy werkzeug hash to bcrypt now that we have the plain-text password
+            get_db().execute("UPDATE users SET password = ? WHERE id = ?", (hash_password(password), user[0]))
+        return jresp({"status": "success", "user_id": user[0]}, 200)
     else:
-        return jsonify({"status": "failed", "message": "Invalid credentials"}), 401 # Unauthorized
+        return jresp(INVALID_CREDENTIALS, 401) # Unauthorized
 
 if __name__ == '__main__':
+    # Development server, also the only option on Windows where gunicorn does not run.
+    # In production on Linux/macOS, serve the API with gunicorn for multiple worker processes.
+    print("Production (Linux/macOS): gunicorn -c gunicorn.conf.py app:app")
+    print("Development (any OS):     flask --app app run --port 5009")
     app.run(host='0.0.0.0', port=5009, debug=True)
\ No newline at end of file
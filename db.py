@@ -1,34 +1,214 @@
 
 import sqlite3
 from flask import g # Keep g for app context usage
+import multiprocessing
 import os
-from werkzeug.security import generate_password_hash # Import for initial hashed passwords
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt # Import for initial hashed passwords
+from werkzeug.security import check_password_hash # Verifies hashes stored before the switch to bcrypt
 
 DATABASE = 'users.db'
+BCRYPT_ROUNDS = 12 # Cost factor; calibrate so one verify takes ~100ms on the target host
+BCRYPT_MAX_PASSWORD_BYTES = 72 # bcrypt ignores (or, in newer releases, rejects) anything longer
+
+# Idle connections kept open between requests: one read-write, the rest read-only.
+# Keyed by the 'readonly' flag passed to _connect().
+_POOLS = {
+    False: queue.LifoQueue(maxsize=1),
+    True: queue.LifoQueue(maxsize=8),
+}
+
+def password_too_long(password):
+    """
+    Returns True if the password is longer than bcrypt can hash without truncating it.
+    """
+    return len(password.encode()) > BCRYPT_MAX_PASSWORD_BYTES
+
+def hash_password(password):
+    """
+    Hashes a plain-text password with bcrypt at the configured cost factor.
+    Callers must reject passwords for which password_too_long() is True.
+    """
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def needs_rehash(hashed_password):
+    """
+    Returns True for stored hashes that are not bcrypt, i.e. werkzeug hashes from before the switch.
+    """
+    return not hashed_password.startswith('$2')
+
+def check_password(password, hashed_password):
+    """
+    Verifies a plain-text password against a stored bcrypt hash.
+    Legacy werkzeug hashes are still verified so those users can log in and be re-hashed.
+    """
+    if needs_rehash(hashed_password):
+        return check_password_hash(hashed_password, password)
+    try:
+        return bcrypt.checkpw(password.encode(), hashed_password.encode())
+    except ValueError: # Malformed hash, or a password bcrypt refuses to process
+        return False
+
+# Per-connection tuning: WAL readers never block on the writer, NORMAL sync skips
+# the fsync on each commit (WAL is still durable at checkpoints), and reads are
+# served from a memory map and a 64MB page cache.
+CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+"""
+
+def _connect(readonly=False):
+    """
+    Opens a tuned connection to DATABASE.
+    Read-only connections are opened through a 'mode=ro' URI so they can never take the write lock.
+    They also return plain tuples: the read handlers select known columns and build their
+    response dicts directly, which is cheaper than going through sqlite3.Row.
+    """
+    conn = sqlite3.connect(
+        f"file:{DATABASE}?mode=ro" if readonly else DATABASE,
+        uri=readonly,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=256, # Reuse prepared statements, keyed by SQL text
+        check_same_thread=False, # Pooled connections are handed to whichever thread serves the next request
+        isolation_level=None # Autocommit: each statement is its own transaction unless a handler issues BEGIN
+    )
+    if not readonly:
+        conn.execute("PRAGMA journal_mode=WAL") # Persistent; covers databases created before WAL was enabled
+    conn.executescript(CONNECTION_PRAGMAS)
+    if not readonly:
+        conn.row_factory = sqlite3.Row # This makes rows behave like dictionaries
+    return conn
+
+def _acquire(readonly=False):
+    """
+    Takes an idle connection from the pool, opening a new one if the pool is empty.
+    """
+    try:
+        return _POOLS[readonly].get_nowait()
+    except queue.Empty:
+        return _connect(readonly)
+
+def _release(conn, readonly=False):
+    """
+    Returns a connection to the pool, or closes it if the pool is already full.
+    Any explicit transaction left open by a failed request is rolled back first.
+    """
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _POOLS[readonly].put_nowait(conn)
+    except queue.Full:
+        conn.close()
 
 def get_db():
     """
     Establishes a database connection for the current request context.
-    If a connection does not exist, it creates one and stores it in Flask's 'g' object.
+    If a connection does not exist, it takes one from the pool and stores it in Flask's 'g' object.
     This ensures that the same connection is used throughout a request lifecycle.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            DATABASE,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row # This makes rows behave like dictionaries
+        g.db = _acquire()
     return g.db
 
+def get_read_db():
+    """
+    Same as get_db(), but returns a read-only connection for handlers that never write.
+    Stored separately in 'g' so a request can hold both if it needs to.
+    """
+    if 'read_db' not in g:
+        g.read_db = _acquire(readonly=True)
+    return g.read_db
+
 def close_db(e=None):
     """
-    Closes the database connection at the end of a request.
+    Hands the request's database connections back to the pool at the end of a request.
     This function is registered with Flask's teardown_appcontext.
     """
-    db = g.pop('db', None)
+    for name, readonly in (('db', False), ('read_db', True)):
+        db = g.pop(name, None)
+
+        if db is not None:
+            _release(db, readonly)
 
-    if db is not None:
-        db.close()
+# Schema statements, all safe to re-run against an existing database.
+# Run by init_db_command on a fresh file and by upgrade_schema() at app startup.
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL
+    )
+    ''',
+    # Covering index for /login: (email, id, password) answers the lookup without touching the table.
+    # The planner always prefers the UNIQUE autoindex on email, so login names this one with INDEXED BY.
+    "CREATE INDEX IF NOT EXISTS idx_users_email_cover ON users(email, id, password)",
+    # Case-insensitive index so /search prefix lookups ("name LIKE 'abc%'") become range seeks
+    "CREATE INDEX IF NOT EXISTS idx_users_name ON users(name COLLATE NOCASE)",
+    # Trigram full-text index over names for substring search, kept in sync by triggers
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        name, content='users', content_rowid='id', tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO users_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    ''',
+)
+
+def _apply_schema(conn):
+    """
+    Creates whatever part of SCHEMA is missing on conn.
+    If users_fts did not exist yet, it is built from the rows already in users.
+    """
+    had_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone() is not None
+    for statement in SCHEMA:
+        conn.execute(statement)
+    if not had_fts:
+        conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def upgrade_schema():
+    """
+    Brings an existing database up to the current schema without touching its data.
+    Runs in one IMMEDIATE transaction so concurrently starting workers apply it only once.
+    Uses its own connection and closes it rather than pooling it, because this runs at import
+    time, which with gunicorn's --preload is the master process, and a SQLite connection
+    must never be carried across fork().
+    Skipped if the database has not been initialized yet.
+    """
+    if not os.path.exists(DATABASE):
+        return
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _apply_schema(conn)
+        conn.execute("COMMIT")
+    finally:
+        conn.close() # Closing without COMMIT rolls back a failed upgrade
+
+# Sample users seeded by init_db_command: (name, email, plain-text password)
+SAMPLE_USERS = [
+    ('John Doe', 'john@example.com', 'password123'),
+    ('Jane Smith', 'jane@example.com', 'secret456'),
+    ('Bob Johnson', 'bob@example.com', 'qwerty789'),
+]
 
 def init_db_command(): # Renamed to avoid confusion with internal init_db function
     """
@@ -36,45 +216,77 @@ def init_db_command(): # Renamed to avoid confusion with internal init_db functi
     This function is designed to be called from the Flask CLI or direct script execution.
     It will create a fresh connection, not use 'g'.
     """
-    # Remove existing database file if present to start fresh
+    # Remove existing database file (and any WAL side files) if present to start fresh
     if os.path.exists(DATABASE):
         os.remove(DATABASE)
         print(f"Removed existing database: {DATABASE}")
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(DATABASE + suffix):
+            os.remove(DATABASE + suffix)
 
     # Establish a direct connection for initialization, not relying on 'g'
     with sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+        # Switch the file to WAL once up front; the setting persists in the database file
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(CONNECTION_PRAGMAS)
         cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL
-        )
-        ''')
+        _apply_schema(conn)
         conn.commit()
 
         # Check if table is empty, then insert sample data
         cursor.execute("SELECT COUNT(*) FROM users")
         if cursor.fetchone()[0] == 0:
-            # Hash passwords for initial sample data for consistency
-            cursor.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-                           ('John Doe', 'john@example.com', generate_password_hash('password123')))
-            cursor.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-                           ('Jane Smith', 'jane@example.com', generate_password_hash('secret456')))
-            cursor.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-                           ('Bob Johnson', 'bob@example.com', generate_password_hash('qwerty789')))
-            conn.commit()
+            # Hash passwords for initial sample data for consistency.
+            # bcrypt releases the GIL, so the hashes are computed in parallel threads
+            with ThreadPoolExecutor(max_workers=len(SAMPLE_USERS)) as executor:
+                hashes = list(executor.map(hash_password, [password for _, _, password in SAMPLE_USERS]))
+            rows = [(name, email, hashed) for (name, email, _), hashed in zip(SAMPLE_USERS, hashes)]
+            with conn: # Single transaction, committed once
+                cursor.executemany("INSERT INTO users (name, email, password) VALUES (?, ?, ?)", rows)
             print("Database initialized with sample data (passwords hashed).")
         else:
             print("Database already contains data, skipping sample data insertion.")
 
+# Full passes over the users table and the indexes behind /login and /search.
+# Run once at startup so the first requests find those pages in the OS page cache and mmap.
+WARM_CACHE_SCRIPT = """
+SELECT sum(length(password)) FROM users;
+SELECT count(*) FROM users INDEXED BY idx_users_email_cover;
+SELECT count(*) FROM users INDEXED BY idx_users_name;
+"""
+
+def warm_cache():
+    """
+    Reads the hot table and index pages through a throwaway read-only connection.
+    The connection is closed, not pooled, for the same fork() reason as upgrade_schema();
+    the pages stay warm in the OS page cache that every later connection reads through.
+    Skipped if the database has not been initialized yet.
+    """
+    try:
+        conn = _connect(readonly=True)
+    except sqlite3.Error:
+        return
+    try:
+        conn.executescript(WARM_CACHE_SCRIPT)
+    except sqlite3.Error as e:
+        print(f"Skipping database cache warm-up: {e}")
+    finally:
+        conn.close()
+
 def init_app(app):
     """
-    Registers the close_db function with the Flask application context.
+    Registers the close_db function with the Flask application context,
+    upgrades the schema of an existing database and warms the page cache.
+    The database steps are skipped inside multiprocessing child processes.
     Also, allows calling init_db_command from Flask CLI if needed.
     """
     app.teardown_appcontext(close_db)
+    if multiprocessing.current_process().name != 'MainProcess':
+        # Imported by a 'spawn' child (e.g. a password pool process re-importing a __main__
+        # app.py); it never serves requests, so leave the database alone
+        return
+    upgrade_schema()
+    warm_cache()
     # If you wanted to expose 'flask init-db' command later, you'd add:
     # app.cli.add_command(init_db_command)
 
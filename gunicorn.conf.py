@@ -0,0 +1,15 @@
+# Gunicorn settings for serving the API: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = "0.0.0.0:5009"
+# One process per core so logins (bcrypt) on different users run in parallel;
+# threads within each worker overlap SQLite I/O, and WAL keeps readers off the writer's lock
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = 8
+
+def post_fork(server, worker):
+    # Tell each worker how many siblings it really has (this honours -w and TTIN/TTOU),
+    # so app.py can split the cores for its password pool
+    os.environ["WEB_CONCURRENCY"] = str(server.num_workers)